@@ -5,372 +5,612 @@ Handles all database operations for face recognition system
 """
 
 import sqlite3
+import threading
+import time
 from datetime import datetime
 import numpy as np
 import os
 
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
 class Database:
     def __init__(self, db_path='data/faces.db'):
         """Initialize database connection"""
         self.db_path = db_path
-        
+
         # Create data directory if it doesn't exist
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        
+
+        fresh_db = not os.path.exists(db_path) or os.path.getsize(db_path) == 0
+
+        # Single long-lived connection shared by all methods.
+        # isolation_level=None puts sqlite3 in autocommit mode so we
+        # control transactions explicitly; the lock serializes access
+        # from the recognition and web threads.
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+
+        # Page size can only be chosen before the first table exists
+        # (changing it later would need a VACUUM), so set it on fresh
+        # databases ahead of the WAL switch
+        if fresh_db:
+            self.conn.execute('PRAGMA page_size=4096')
+
+        # WAL allows concurrent readers during writes; NORMAL sync is
+        # safe with WAL and avoids an fsync per commit
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA temp_store=MEMORY')
+        self.conn.execute('PRAGMA cache_size=-64000')
+
+        # Memory-map up to 256MB of the file so warm reads come
+        # straight from the page cache without read() copies
+        self.conn.execute('PRAGMA mmap_size=268435456')
+
+        # Write buffers - visits and unknown visitors are batched and
+        # flushed in one transaction instead of committing per event
+        self._visit_buffer = []
+        self._unknown_buffer = []
+        self._image_buffer = []
+        self._flush_threshold = 50
+        self._flush_interval = 1.0  # seconds
+        self._last_flush = time.monotonic()
+
+        # Reusable cursor plus canned SQL for the hot write path:
+        # passing the identical statement string lets sqlite3 serve it
+        # from its prepared-statement cache instead of re-parsing
+        self._cur = self.conn.cursor()
+        self._stmt = {
+            'insert_visit': '''
+                INSERT INTO visits (person_id, confidence, image_path)
+                VALUES (?, ?, ?)
+            ''',
+            'insert_unknown': '''
+                INSERT INTO unknown_visitors (image_path, face_encoding)
+                VALUES (?, ?)
+            ''',
+            'insert_image': '''
+                INSERT INTO face_images (id, jpeg)
+                VALUES (?, ?)
+            ''',
+        }
+
         self.init_database()
-    
+        self._migrate_encodings()
+
+        # Image ids are handed out before the batched INSERT runs, so
+        # callers get a usable db://<id> path without a commit per crop
+        self._next_image_id = self.conn.execute(
+            'SELECT COALESCE(MAX(id), 0) FROM face_images').fetchone()[0]
+
+        # _maybe_flush only runs when the next event arrives, so a
+        # small daemon timer lands buffered rows during quiet spells
+        # (and keeps them out of harm's way if the process dies)
+        self._closed = False
+        self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flush_thread.start()
+
+    # Raw (uncompressed) BLOB sizes for a 128-dim encoding; anything
+    # else is assumed to be blosc-compressed
+    _RAW_FLOAT64_SIZE = 1024
+    _RAW_FLOAT16_SIZE = 256
+
+    @staticmethod
+    def pack_encoding(face_encoding):
+        """Pack a face encoding into its stored BLOB form
+
+        Encodings are L2-normalized (so matching reduces to a dot
+        product), stored as float16 (face embeddings carry nowhere near
+        float64 precision) and, when blosc is available, run through
+        its SIMD shuffle + LZ4 codec for a further size cut.
+        """
+        norm = np.linalg.norm(face_encoding)
+        if norm > 0:
+            face_encoding = face_encoding / norm
+        raw = face_encoding.astype(np.float16).tobytes()
+        if blosc is not None:
+            return blosc.compress(raw, typesize=2, cname='lz4', shuffle=blosc.SHUFFLE)
+        return raw
+
+    @staticmethod
+    def unpack_encoding(blob):
+        """Unpack a stored encoding BLOB to a float32 array"""
+        if len(blob) == Database._RAW_FLOAT64_SIZE:
+            # Legacy row: raw float64 bytes
+            return np.frombuffer(blob, dtype=np.float64).astype(np.float32)
+        if len(blob) == Database._RAW_FLOAT16_SIZE:
+            return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+        return np.frombuffer(blosc.decompress(blob), dtype=np.float16).astype(np.float32)
+
+    def _migrate_encodings(self):
+        """Re-pack any legacy uncompressed encodings in place"""
+        raw_sizes = (self._RAW_FLOAT64_SIZE, self._RAW_FLOAT16_SIZE)
+        if blosc is None:
+            raw_sizes = (self._RAW_FLOAT64_SIZE,)
+
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT id, face_encoding FROM persons')
+            legacy = [(row['id'], row['face_encoding'])
+                      for row in cursor.fetchall()
+                      if len(row['face_encoding']) in raw_sizes]
+
+            if not legacy:
+                return
+
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.executemany(
+                'UPDATE persons SET face_encoding = ? WHERE id = ?',
+                [(self.pack_encoding(self.unpack_encoding(blob)), person_id)
+                 for person_id, blob in legacy]
+            )
+            cursor.execute('COMMIT')
+            print(f"✓ Migrated {len(legacy)} face encodings to packed format")
+
     def init_database(self):
         """Initialize database tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Persons table - stores registered individuals
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS persons (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL UNIQUE,
-                face_encoding BLOB NOT NULL,
-                first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                visit_count INTEGER DEFAULT 0,
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Visits table - logs each visit by known persons
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS visits (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                person_id INTEGER NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                confidence REAL,
-                image_path TEXT,
-                FOREIGN KEY (person_id) REFERENCES persons(id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # Unknown visitors table - stores unidentified faces
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS unknown_visitors (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                image_path TEXT,
-                identified BOOLEAN DEFAULT 0,
-                identified_as INTEGER,
-                FOREIGN KEY (identified_as) REFERENCES persons(id)
-            )
-        ''')
-        
-        # Create indexes for better performance
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_visits_person_id 
-            ON visits(person_id)
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_visits_timestamp 
-            ON visits(timestamp DESC)
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_unknown_timestamp 
-            ON unknown_visitors(timestamp DESC)
-        ''')
-        
-        conn.commit()
-        conn.close()
-        
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('BEGIN')
+
+            # Persons table - stores registered individuals
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS persons (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL UNIQUE,
+                    face_encoding BLOB NOT NULL,
+                    first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    visit_count INTEGER DEFAULT 0,
+                    notes TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Visits table - logs each visit by known persons
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS visits (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    person_id INTEGER NOT NULL,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    confidence REAL,
+                    image_path TEXT,
+                    FOREIGN KEY (person_id) REFERENCES persons(id) ON DELETE CASCADE
+                )
+            ''')
+
+            # Unknown visitors table - stores unidentified faces along
+            # with the encoding computed at detection time, so
+            # identifying one later never re-runs the dlib pipeline
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS unknown_visitors (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    image_path TEXT,
+                    face_encoding BLOB,
+                    identified BOOLEAN DEFAULT 0,
+                    identified_as INTEGER,
+                    FOREIGN KEY (identified_as) REFERENCES persons(id)
+                )
+            ''')
+
+            # Older databases predate the face_encoding column
+            cursor.execute('PRAGMA table_info(unknown_visitors)')
+            columns = [row[1] for row in cursor.fetchall()]
+            if 'face_encoding' not in columns:
+                cursor.execute('ALTER TABLE unknown_visitors ADD COLUMN face_encoding BLOB')
+
+            # Face images table - optional BLOB storage for face crops;
+            # SQLite beats the filesystem for blobs this small and
+            # avoids per-file block padding
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS face_images (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    jpeg BLOB NOT NULL
+                )
+            ''')
+
+            # Create indexes for better performance
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_visits_person_id
+                ON visits(person_id)
+            ''')
+
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_visits_timestamp
+                ON visits(timestamp DESC)
+            ''')
+
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_unknown_timestamp
+                ON unknown_visitors(timestamp DESC)
+            ''')
+
+            # The denormalized last_seen/visit_count columns are kept
+            # by the engine itself, so logging a visit is one INSERT
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_visit_stamp
+                AFTER INSERT ON visits
+                BEGIN
+                    UPDATE persons
+                    SET last_seen = NEW.timestamp,
+                        visit_count = visit_count + 1
+                    WHERE id = NEW.person_id;
+                END
+            ''')
+
+            cursor.execute('COMMIT')
+
         print("✓ Database initialized successfully")
-    
+
     def add_person(self, name, face_encoding, notes=''):
         """Add a new person to database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            # Convert numpy array to bytes
-            encoding_blob = face_encoding.tobytes()
-            
-            cursor.execute('''
-                INSERT INTO persons (name, face_encoding, notes)
-                VALUES (?, ?, ?)
-            ''', (name, encoding_blob, notes))
-            
-            person_id = cursor.lastrowid
-            conn.commit()
-            print(f"✓ Added person: {name} (ID: {person_id})")
-            return person_id
-            
-        except sqlite3.IntegrityError:
-            print(f"⚠ Person with name '{name}' already exists")
-            return None
-        except Exception as e:
-            print(f"❌ Error adding person: {e}")
-            return None
-        finally:
-            conn.close()
-    
+        with self._lock:
+            cursor = self.conn.cursor()
+
+            try:
+                encoding_blob = self.pack_encoding(face_encoding)
+
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute('''
+                    INSERT INTO persons (name, face_encoding, notes)
+                    VALUES (?, ?, ?)
+                ''', (name, encoding_blob, notes))
+
+                person_id = cursor.lastrowid
+                cursor.execute('COMMIT')
+                print(f"✓ Added person: {name} (ID: {person_id})")
+                return person_id
+
+            except sqlite3.IntegrityError:
+                cursor.execute('ROLLBACK')
+                print(f"⚠ Person with name '{name}' already exists")
+                return None
+            except Exception as e:
+                cursor.execute('ROLLBACK')
+                print(f"❌ Error adding person: {e}")
+                return None
+
+    def count_persons(self):
+        """Count registered persons"""
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM persons')
+            return cursor.fetchone()[0]
+
+    def iter_encodings(self):
+        """Yield (id, name, face_encoding) tuples for all persons
+
+        Narrow projection for the recognition pipeline: no dict per
+        row and none of the metadata columns it never reads.
+        """
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT id, name, face_encoding FROM persons ORDER BY name')
+            rows = cursor.fetchall()
+
+        for row in rows:
+            yield row[0], row[1], row[2]
+
     def get_all_persons(self):
         """Get all persons from database"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, name, face_encoding, first_seen, last_seen, 
-                   visit_count, notes, created_at
-            FROM persons
-            ORDER BY name
-        ''')
-        
-        persons = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        return persons
-    
+        with self._lock:
+            cursor = self.conn.cursor()
+
+            cursor.execute('''
+                SELECT id, name, face_encoding, first_seen, last_seen,
+                       visit_count, notes, created_at
+                FROM persons
+                ORDER BY name
+            ''')
+
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_all_persons_summary(self):
+        """Get all persons without the encoding blobs (for listings/API)"""
+        with self._lock:
+            cursor = self.conn.cursor()
+
+            cursor.execute('''
+                SELECT id, name, first_seen, last_seen,
+                       visit_count, notes, created_at
+                FROM persons
+                ORDER BY name
+            ''')
+
+            return [dict(row) for row in cursor.fetchall()]
+
     def get_person(self, person_id):
         """Get a specific person by ID"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, name, face_encoding, first_seen, last_seen,
-                   visit_count, notes, created_at
-            FROM persons 
-            WHERE id = ?
-        ''', (person_id,))
-        
-        person = cursor.fetchone()
-        conn.close()
-        
-        return dict(person) if person else None
-    
+        with self._lock:
+            cursor = self.conn.cursor()
+
+            cursor.execute('''
+                SELECT id, name, face_encoding, first_seen, last_seen,
+                       visit_count, notes, created_at
+                FROM persons
+                WHERE id = ?
+            ''', (person_id,))
+
+            person = cursor.fetchone()
+
+            return dict(person) if person else None
+
     def get_person_by_name(self, name):
         """Get a specific person by name"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, name, face_encoding, first_seen, last_seen,
-                   visit_count, notes, created_at
-            FROM persons 
-            WHERE name = ?
-        ''', (name,))
-        
-        person = cursor.fetchone()
-        conn.close()
-        
-        return dict(person) if person else None
-    
+        with self._lock:
+            cursor = self.conn.cursor()
+
+            cursor.execute('''
+                SELECT id, name, face_encoding, first_seen, last_seen,
+                       visit_count, notes, created_at
+                FROM persons
+                WHERE name = ?
+            ''', (name,))
+
+            person = cursor.fetchone()
+
+            return dict(person) if person else None
+
     def update_person(self, person_id, name=None, notes=None):
         """Update person information"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            if name:
-                cursor.execute('''
-                    UPDATE persons SET name = ? WHERE id = ?
-                ''', (name, person_id))
-            
-            if notes is not None:
-                cursor.execute('''
-                    UPDATE persons SET notes = ? WHERE id = ?
-                ''', (notes, person_id))
-            
-            conn.commit()
-            print(f"✓ Updated person ID: {person_id}")
-            return True
-            
-        except sqlite3.IntegrityError:
-            print(f"⚠ Person with name '{name}' already exists")
-            return False
-        except Exception as e:
-            print(f"❌ Error updating person: {e}")
-            return False
-        finally:
-            conn.close()
-    
+        with self._lock:
+            cursor = self.conn.cursor()
+
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                if name:
+                    cursor.execute('''
+                        UPDATE persons SET name = ? WHERE id = ?
+                    ''', (name, person_id))
+
+                if notes is not None:
+                    cursor.execute('''
+                        UPDATE persons SET notes = ? WHERE id = ?
+                    ''', (notes, person_id))
+
+                cursor.execute('COMMIT')
+                print(f"✓ Updated person ID: {person_id}")
+                return True
+
+            except sqlite3.IntegrityError:
+                cursor.execute('ROLLBACK')
+                print(f"⚠ Person with name '{name}' already exists")
+                return False
+            except Exception as e:
+                cursor.execute('ROLLBACK')
+                print(f"❌ Error updating person: {e}")
+                return False
+
     def delete_person(self, person_id):
         """Delete a person and all their visits"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            # Delete visits first (cascade should handle this, but being explicit)
-            cursor.execute('DELETE FROM visits WHERE person_id = ?', (person_id,))
-            
-            # Delete person
-            cursor.execute('DELETE FROM persons WHERE id = ?', (person_id,))
-            
-            conn.commit()
-            print(f"✓ Deleted person ID: {person_id}")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Error deleting person: {e}")
-            return False
-        finally:
-            conn.close()
-    
+        with self._lock:
+            self._flush()
+            cursor = self.conn.cursor()
+
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                # Delete visits first (cascade should handle this, but being explicit)
+                cursor.execute('DELETE FROM visits WHERE person_id = ?', (person_id,))
+
+                # Delete person
+                cursor.execute('DELETE FROM persons WHERE id = ?', (person_id,))
+
+                cursor.execute('COMMIT')
+                print(f"✓ Deleted person ID: {person_id}")
+                return True
+
+            except Exception as e:
+                cursor.execute('ROLLBACK')
+                print(f"❌ Error deleting person: {e}")
+                return False
+
     def log_visit(self, person_id, confidence, image_path):
-        """Log a visit by a known person"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            # Insert visit record
-            cursor.execute('''
-                INSERT INTO visits (person_id, confidence, image_path)
-                VALUES (?, ?, ?)
-            ''', (person_id, confidence, image_path))
-            
-            # Update person's last seen and visit count
-            cursor.execute('''
-                UPDATE persons 
-                SET last_seen = CURRENT_TIMESTAMP,
-                    visit_count = visit_count + 1
-                WHERE id = ?
-            ''', (person_id,))
-            
-            conn.commit()
-            return cursor.lastrowid
-            
-        except Exception as e:
-            print(f"❌ Error logging visit: {e}")
-            return None
-        finally:
-            conn.close()
-    
-    def log_unknown_visitor(self, image_path):
-        """Log an unknown visitor"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        """Log a visit by a known person (buffered, flushed in batches)"""
+        with self._lock:
+            self._visit_buffer.append((person_id, confidence, image_path))
+            self._maybe_flush()
+
+    def log_unknown_visitor(self, image_path, face_encoding=None):
+        """Log an unknown visitor (buffered, flushed in batches)"""
+        blob = self.pack_encoding(face_encoding) if face_encoding is not None else None
+        with self._lock:
+            self._unknown_buffer.append((image_path, blob))
+            self._maybe_flush()
+
+    def _maybe_flush(self):
+        """Flush buffers if they are large or old enough (lock held)"""
+        pending = (len(self._visit_buffer) + len(self._unknown_buffer)
+                   + len(self._image_buffer))
+        if pending >= self._flush_threshold or \
+           time.monotonic() - self._last_flush >= self._flush_interval:
+            self._flush()
+
+    def _flush(self):
+        """Write buffered visits in a single transaction (lock held)"""
+        self._last_flush = time.monotonic()
+
+        if not self._visit_buffer and not self._unknown_buffer \
+                and not self._image_buffer:
+            return
+
+        cursor = self._cur
+
         try:
-            cursor.execute('''
-                INSERT INTO unknown_visitors (image_path)
-                VALUES (?)
-            ''', (image_path,))
-            
-            conn.commit()
-            return cursor.lastrowid
-            
+            cursor.execute('BEGIN IMMEDIATE')
+
+            # Crops first: visits and unknowns may reference their ids
+            if self._image_buffer:
+                cursor.executemany(self._stmt['insert_image'], self._image_buffer)
+
+            if self._visit_buffer:
+                # trg_visit_stamp keeps last_seen/visit_count in sync
+                cursor.executemany(self._stmt['insert_visit'], self._visit_buffer)
+
+            if self._unknown_buffer:
+                cursor.executemany(self._stmt['insert_unknown'], self._unknown_buffer)
+
+            cursor.execute('COMMIT')
+            self._visit_buffer = []
+            self._unknown_buffer = []
+            self._image_buffer = []
+
         except Exception as e:
-            print(f"❌ Error logging unknown visitor: {e}")
-            return None
-        finally:
-            conn.close()
-    
+            cursor.execute('ROLLBACK')
+            print(f"❌ Error flushing visit buffer: {e}")
+
+    def flush(self):
+        """Flush any buffered writes to disk"""
+        with self._lock:
+            self._flush()
+
+    def _flush_loop(self):
+        """Periodically flush buffers so rows land without new events"""
+        while not self._closed:
+            time.sleep(self._flush_interval)
+            with self._lock:
+                if self._visit_buffer or self._unknown_buffer \
+                        or self._image_buffer:
+                    self._flush()
+
+    def save_face_image(self, jpeg_bytes):
+        """Store a JPEG face crop (buffered), returning its image id"""
+        with self._lock:
+            self._next_image_id += 1
+            image_id = self._next_image_id
+            self._image_buffer.append((image_id, jpeg_bytes))
+            self._maybe_flush()
+            return image_id
+
+    def get_face_image(self, image_id):
+        """Get a stored JPEG face crop by id"""
+        with self._lock:
+            self._flush()
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT jpeg FROM face_images WHERE id = ?', (image_id,))
+            row = cursor.fetchone()
+            return row['jpeg'] if row else None
+
     def get_recent_visits(self, limit=50, person_id=None):
         """Get recent visits"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        if person_id:
+        with self._lock:
+            self._flush()
+            cursor = self.conn.cursor()
+
+            if person_id:
+                cursor.execute('''
+                    SELECT v.*, p.name
+                    FROM visits v
+                    JOIN persons p ON v.person_id = p.id
+                    WHERE v.person_id = ?
+                    ORDER BY v.timestamp DESC
+                    LIMIT ?
+                ''', (person_id, limit))
+            else:
+                cursor.execute('''
+                    SELECT v.*, p.name
+                    FROM visits v
+                    JOIN persons p ON v.person_id = p.id
+                    ORDER BY v.timestamp DESC
+                    LIMIT ?
+                ''', (limit,))
+
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_unknown_visitors(self, limit=50, identified=False):
+        """Get unknown visitors"""
+        with self._lock:
+            self._flush()
+            cursor = self.conn.cursor()
+
+            # The encoding blob is not JSON-serializable and only the
+            # identify path needs it (see get_unknown_visitor)
             cursor.execute('''
-                SELECT v.*, p.name 
-                FROM visits v
-                JOIN persons p ON v.person_id = p.id
-                WHERE v.person_id = ?
-                ORDER BY v.timestamp DESC
+                SELECT id, timestamp, image_path, identified, identified_as
+                FROM unknown_visitors
+                WHERE identified = ?
+                ORDER BY timestamp DESC
                 LIMIT ?
-            ''', (person_id, limit))
-        else:
+            ''', (1 if identified else 0, limit))
+
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_unknown_visitor(self, unknown_id):
+        """Get a specific unknown visitor by ID"""
+        with self._lock:
+            self._flush()
+            cursor = self.conn.cursor()
+
             cursor.execute('''
-                SELECT v.*, p.name 
-                FROM visits v
-                JOIN persons p ON v.person_id = p.id
-                ORDER BY v.timestamp DESC
-                LIMIT ?
-            ''', (limit,))
-        
-        visits = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        return visits
-    
-    def get_unknown_visitors(self, limit=50, identified=False):
-        """Get unknown visitors"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM unknown_visitors
-            WHERE identified = ?
-            ORDER BY timestamp DESC
-            LIMIT ?
-        ''', (1 if identified else 0, limit))
-        
-        visitors = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        return visitors
-    
+                SELECT * FROM unknown_visitors
+                WHERE id = ?
+                LIMIT 1
+            ''', (unknown_id,))
+
+            row = cursor.fetchone()
+
+            return dict(row) if row else None
+
     def mark_unknown_as_identified(self, unknown_id, person_id):
         """Mark an unknown visitor as identified"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                UPDATE unknown_visitors
-                SET identified = 1, identified_as = ?
-                WHERE id = ?
-            ''', (person_id, unknown_id))
-            
-            conn.commit()
-            return True
-            
-        except Exception as e:
-            print(f"❌ Error marking as identified: {e}")
-            return False
-        finally:
-            conn.close()
-    
+        with self._lock:
+            cursor = self.conn.cursor()
+
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute('''
+                    UPDATE unknown_visitors
+                    SET identified = 1, identified_as = ?
+                    WHERE id = ?
+                ''', (person_id, unknown_id))
+
+                cursor.execute('COMMIT')
+                return True
+
+            except Exception as e:
+                cursor.execute('ROLLBACK')
+                print(f"❌ Error marking as identified: {e}")
+                return False
+
     def get_statistics(self):
         """Get system statistics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        stats = {}
-        
-        # Total persons
-        cursor.execute('SELECT COUNT(*) FROM persons')
-        stats['total_persons'] = cursor.fetchone()[0]
-        
-        # Total visits
-        cursor.execute('SELECT COUNT(*) FROM visits')
-        stats['total_visits'] = cursor.fetchone()[0]
-        
-        # Unknown visitors
-        cursor.execute('SELECT COUNT(*) FROM unknown_visitors WHERE identified = 0')
-        stats['unknown_visitors'] = cursor.fetchone()[0]
-        
-        # Visits today
-        cursor.execute('''
-            SELECT COUNT(*) FROM visits 
-            WHERE DATE(timestamp) = DATE('now')
-        ''')
-        stats['visits_today'] = cursor.fetchone()[0]
-        
-        # Most frequent visitor
-        cursor.execute('''
-            SELECT p.name, p.visit_count
-            FROM persons p
-            ORDER BY p.visit_count DESC
-            LIMIT 1
-        ''')
-        result = cursor.fetchone()
-        stats['most_frequent_visitor'] = {
-            'name': result[0] if result else None,
-            'count': result[1] if result else 0
-        }
-        
-        conn.close()
-        return stats
+        with self._lock:
+            self._flush()
+            cursor = self.conn.cursor()
+
+            # One statement instead of five; the today-filter compares
+            # against date('now') directly so the timestamp index is
+            # usable (DATE(timestamp) = ... would force a full scan)
+            cursor.execute('''
+                SELECT
+                    (SELECT COUNT(*) FROM persons),
+                    (SELECT COUNT(*) FROM visits),
+                    (SELECT COUNT(*) FROM unknown_visitors WHERE identified = 0),
+                    (SELECT COUNT(*) FROM visits WHERE timestamp >= date('now')),
+                    (SELECT name FROM persons ORDER BY visit_count DESC LIMIT 1),
+                    (SELECT MAX(visit_count) FROM persons)
+            ''')
+            row = cursor.fetchone()
+
+            return {
+                'total_persons': row[0],
+                'total_visits': row[1],
+                'unknown_visitors': row[2],
+                'visits_today': row[3],
+                'most_frequent_visitor': {
+                    'name': row[4],
+                    'count': row[5] if row[5] is not None else 0
+                }
+            }
+
+    def close(self):
+        """Flush pending writes and close the database connection"""
+        self._closed = True
+        with self._lock:
+            self._flush()
+            self.conn.close()
@@ -5,6 +5,7 @@ Handles connection to CP Plus DVR via RTSP stream
 """
 
 import cv2
+import os
 import time
 from datetime import datetime
 
@@ -30,9 +31,26 @@ class DVRConnector:
         # CP Plus DVR RTSP URL format
         # Format: rtsp://username:password@ip:port/cam/realmonitor?channel=X&subtype=Y
         rtsp_url = f"rtsp://{username}:{password}@{ip}:{port}/cam/realmonitor?channel={channel}&subtype={subtype}"
-        
+
         return rtsp_url
-    
+
+    def _open_capture(self):
+        """Open the video capture, using hardware decode when configured"""
+        # Full custom GStreamer pipeline, e.g.
+        # "rtspsrc location={url} latency=100 ! rtph264depay ! h264parse
+        #  ! nvh264dec ! videoconvert ! appsink"
+        pipeline = self.config.get('gstreamer_pipeline')
+        if pipeline:
+            return cv2.VideoCapture(pipeline.format(url=self.rtsp_url), cv2.CAP_GSTREAMER)
+
+        # Hardware decoder for the FFmpeg backend (e.g. "cuda", "vaapi");
+        # must be set in the environment before the capture is created
+        hwaccel = self.config.get('hwaccel')
+        if hwaccel:
+            os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = f'hwaccel;{hwaccel}'
+
+        return cv2.VideoCapture(self.rtsp_url)
+
     def connect(self):
         """Connect to DVR stream"""
         print(f"📡 Connecting to DVR at {self.config['ip']}...")
@@ -43,7 +61,7 @@ class DVRConnector:
                 self.cap.release()
             
             # Create new connection
-            self.cap = cv2.VideoCapture(self.rtsp_url)
+            self.cap = self._open_capture()
             
             # Set buffer size to reduce latency
             self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
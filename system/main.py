@@ -5,10 +5,12 @@ Connects to CP Plus DVR and performs real-time face recognition
 """
 
 import cv2
+import dlib
 import face_recognition
 import numpy as np
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from database import Database
 from dvr_connector import DVRConnector
@@ -17,6 +19,11 @@ import json
 import os
 import sys
 
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
 class FaceRecognitionSystem:
     def __init__(self, config_path='config/config.json'):
         """Initialize the face recognition system"""
@@ -33,8 +40,52 @@ class FaceRecognitionSystem:
         # Initialize components
         self.db = Database()
         self.dvr = DVRConnector(self.config['dvr'])
-        self.notifier = Notifier(self.config.get('notifications', {}))
+        self.notifier = Notifier(self.config.get('notifications', {}), db=self.db)
         
+        # The sub-stream (subtype=1) is already detection-sized, so it
+        # needs no further downscale; the full-resolution main stream
+        # gets the classic 1/4 resize before detection
+        recognition_config = self.config.get('recognition', {})
+        if 'downscale' in recognition_config:
+            self.downscale = recognition_config['downscale']
+        elif self.config['dvr'].get('subtype', 0) == 1:
+            self.downscale = 1.0
+        else:
+            self.downscale = 0.25
+
+        # Face detector: dlib's CNN model on CUDA when available (frames
+        # are batched to amortize kernel launches), CPU HOG otherwise
+        self.detection_model = recognition_config.get('model', 'auto')
+        if self.detection_model == 'auto':
+            self.detection_model = 'cnn' if getattr(dlib, 'DLIB_USE_CUDA', False) else 'hog'
+        self.detection_batch_size = (
+            recognition_config.get('batch_size', 4) if self.detection_model == 'cnn' else 1
+        )
+        # A partial batch is flushed once its oldest frame is this old,
+        # so a lone detection is never stuck waiting for the batch to fill
+        self.batch_max_age = recognition_config.get('batch_max_age', 1.0)
+        print(f"✓ Face detector: {self.detection_model} (batch size {self.detection_batch_size})")
+
+        # Motion gate: a cheap frame diff decides whether the face
+        # pipeline runs at all, so an empty entrance costs almost nothing
+        self.motion_threshold = recognition_config.get('motion_threshold', 4.0)
+        self.motion_safety_interval = recognition_config.get('motion_safety_interval', 10)
+
+        # Face crops can be kept as BLOBs in the database instead of
+        # one small JPEG file each; image paths then take the form
+        # db://<id> and are served by the web interface from the table
+        self.store_images_in_db = recognition_config.get('store_images_in_db', False)
+
+        self.tolerance = recognition_config.get('tolerance', 0.6)
+
+        # OpenCV's T-API offloads resize/cvtColor to OpenCL (iGPU)
+        # when a device is present, freeing the CPU decoder thread
+        self._use_opencl = bool(recognition_config.get('opencl', True)) and cv2.ocl.haveOpenCL()
+        if self._use_opencl:
+            print("✓ OpenCL frame preprocessing enabled")
+        self._prev_motion_gray = None
+        self._sampled_count = 0
+
         # Load known faces
         self.known_faces = self.load_known_faces()
         print(f"✓ Loaded {len(self.known_faces['names'])} known faces")
@@ -42,95 +93,194 @@ class FaceRecognitionSystem:
         # System state
         self.running = False
         self.last_seen = {}  # Track last seen time to avoid duplicate notifications
+
+        # Latest-frame slot shared with the reader thread: the reader
+        # keeps draining the RTSP socket while recognition always works
+        # on the newest frame, so no backlog builds up in the stream
+        self._latest_frame = None
+        self._frame_seq = 0
+        self._frame_lock = threading.Lock()
+        self._reader_thread = None
+
+        # Face crops are written to disk off the recognition loop
+        self._io_pool = ThreadPoolExecutor(max_workers=2)
         
     def load_known_faces(self):
-        """Load all known faces from database"""
-        persons = self.db.get_all_persons()
-        known_faces = {
-            'encodings': [],
-            'names': [],
-            'ids': []
-        }
-        
-        for person in persons:
+        """Load all known faces from database into one contiguous matrix"""
+        # One (N, 128) float32 matrix instead of a list of float64
+        # arrays: preallocated from the row count and filled in place,
+        # with no per-row dicts or intermediate lists
+        count = self.db.count_persons()
+        matrix = np.empty((count, 128), dtype=np.float32)
+        names = []
+        ids = []
+        loaded = 0
+
+        for person_id, person_name, blob in self.db.iter_encodings():
             try:
-                encoding = np.frombuffer(person['face_encoding'], dtype=np.float64)
-                known_faces['encodings'].append(encoding)
-                known_faces['names'].append(person['name'])
-                known_faces['ids'].append(person['id'])
+                encoding = Database.unpack_encoding(blob)
+                # New rows are stored unit-norm; normalizing here too
+                # keeps legacy rows on the dot-product match path
+                norm = np.linalg.norm(encoding)
+                if norm > 0:
+                    encoding /= norm
+                matrix[loaded] = encoding
+                names.append(person_name)
+                ids.append(person_id)
+                loaded += 1
             except Exception as e:
-                print(f"⚠ Error loading face for {person.get('name', 'unknown')}: {e}")
-        
-        return known_faces
+                print(f"⚠ Error loading face for {person_name}: {e}")
+
+        if loaded != count:
+            matrix = matrix[:loaded]
+
+        # With faiss available, nearest-face lookup goes through an
+        # inner-product index: exact flat search for small enrollments,
+        # HNSW once a linear scan would start to hurt
+        index = None
+        if faiss is not None and len(names) > 0:
+            if len(names) >= 1000:
+                index = faiss.IndexHNSWFlat(128, 32, faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexFlatIP(128)
+            index.add(matrix)
+
+        return {
+            'matrix': matrix,
+            'names': names,
+            'ids': ids,
+            'index': index
+        }
     
     def reload_known_faces(self):
         """Reload known faces (call when database is updated)"""
         self.known_faces = self.load_known_faces()
         print(f"🔄 Reloaded {len(self.known_faces['names'])} known faces")
     
+    def _prepare_frame(self, frame):
+        """Downscale (main stream only) and convert a frame to RGB"""
+        if self._use_opencl:
+            umat = cv2.UMat(frame)
+            if self.downscale != 1.0:
+                umat = cv2.resize(umat, (0, 0), fx=self.downscale, fy=self.downscale)
+            # .get() downloads the finished RGB frame for dlib
+            return cv2.cvtColor(umat, cv2.COLOR_BGR2RGB).get()
+
+        if self.downscale != 1.0:
+            frame = cv2.resize(frame, (0, 0), fx=self.downscale, fy=self.downscale)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def _detect_faces(self, rgb_frames):
+        """Detect face locations in a batch of RGB frames"""
+        if self.detection_model == 'cnn':
+            return face_recognition.batch_face_locations(
+                rgb_frames,
+                number_of_times_to_upsample=0,
+                batch_size=len(rgb_frames)
+            )
+        return [face_recognition.face_locations(rgb, model='hog') for rgb in rgb_frames]
+
+    def _scene_changed(self, frame):
+        """Cheap SAD gate: has the scene changed since the last sample?"""
+        gray = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 36))
+
+        if self._prev_motion_gray is None:
+            self._prev_motion_gray = gray
+            return True
+
+        diff = float(cv2.absdiff(self._prev_motion_gray, gray).mean())
+        self._prev_motion_gray = gray
+
+        return diff > self.motion_threshold
+
     def process_frame(self, frame):
         """Process a single frame for face recognition"""
-        # Resize frame for faster processing (1/4 size)
-        small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-        rgb_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-        
-        # Find all faces in the frame
-        face_locations = face_recognition.face_locations(rgb_frame, model='hog')
-        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
-        
+        return self.process_frames([frame])
+
+    def process_frames(self, frames):
+        """Process a batch of frames for face recognition"""
+        rgb_frames = [self._prepare_frame(frame) for frame in frames]
+        batch_locations = self._detect_faces(rgb_frames)
+
         recognized_persons = []
-        
-        for face_encoding, face_location in zip(face_encodings, face_locations):
-            name = "Unknown"
-            person_id = None
-            confidence = 0
-            
-            # Compare with known faces
-            if len(self.known_faces['encodings']) > 0:
-                matches = face_recognition.compare_faces(
-                    self.known_faces['encodings'], 
-                    face_encoding,
-                    tolerance=self.config.get('recognition', {}).get('tolerance', 0.6)
-                )
+
+        for frame, rgb_frame, face_locations in zip(frames, rgb_frames, batch_locations):
+            if not face_locations:
+                continue
+
+            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+
+            for face_encoding, face_location in zip(face_encodings, face_locations):
+                name = "Unknown"
+                person_id = None
+                confidence = 0
                 
-                if True in matches:
-                    face_distances = face_recognition.face_distance(
-                        self.known_faces['encodings'], 
-                        face_encoding
-                    )
-                    best_match_index = np.argmin(face_distances)
-                    
-                    if matches[best_match_index]:
+                # Compare with known faces - with unit-norm encodings a
+                # single matrix-vector product gives all similarities,
+                # and ||x - y||^2 == 2 - 2*(x . y) recovers the distance
+                if len(self.known_faces['names']) > 0:
+                    probe = face_encoding.astype(np.float32)
+                    probe_norm = np.linalg.norm(probe)
+                    if probe_norm > 0:
+                        probe /= probe_norm
+
+                    if self.known_faces['index'] is not None:
+                        sims, idxs = self.known_faces['index'].search(probe[None, :], 1)
+                        best_match_index = int(idxs[0, 0])
+                        best_similarity = float(sims[0, 0])
+                    else:
+                        similarities = self.known_faces['matrix'] @ probe
+                        best_match_index = int(similarities.argmax())
+                        best_similarity = float(similarities[best_match_index])
+
+                    best_distance = float(np.sqrt(max(0.0, 2.0 - 2.0 * best_similarity)))
+
+                    if best_distance <= self.tolerance:
                         name = self.known_faces['names'][best_match_index]
                         person_id = self.known_faces['ids'][best_match_index]
-                        confidence = 1 - face_distances[best_match_index]
-            
-            # Scale back face location to original frame size
-            top, right, bottom, left = face_location
-            top *= 4
-            right *= 4
-            bottom *= 4
-            left *= 4
-            
-            # Extract and save face image
-            face_img = frame[top:bottom, left:right]
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-            
-            # Create images directory if it doesn't exist
-            os.makedirs('data/images', exist_ok=True)
-            
-            img_filename = f"{timestamp}_{name.replace(' ', '_')}.jpg"
-            img_path = f"data/images/{img_filename}"
-            cv2.imwrite(img_path, face_img)
-            
-            recognized_persons.append({
-                'name': name,
-                'person_id': person_id,
-                'confidence': confidence,
-                'image_path': img_path,
-                'location': (top, right, bottom, left),
-                'timestamp': datetime.now()
-            })
+                        confidence = 1 - best_distance
+                
+                # Scale back face location to original frame size
+                top, right, bottom, left = face_location
+                if self.downscale != 1.0:
+                    inv = 1.0 / self.downscale
+                    top = int(top * inv)
+                    right = int(right * inv)
+                    bottom = int(bottom * inv)
+                    left = int(left * inv)
+                
+                # Extract and save face image
+                face_img = frame[top:bottom, left:right]
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+
+                write_future = None
+                if self.store_images_in_db:
+                    ok, buf = cv2.imencode('.jpg', face_img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+                    image_id = self.db.save_face_image(buf.tobytes()) if ok else None
+                    img_path = f"db://{image_id}" if image_id else None
+                else:
+                    # Create images directory if it doesn't exist
+                    os.makedirs('data/images', exist_ok=True)
+
+                    img_filename = f"{timestamp}_{name.replace(' ', '_')}.jpg"
+                    img_path = f"data/images/{img_filename}"
+                    # Copy the crop so the write doesn't alias a frame the
+                    # reader thread may overwrite, then encode off-thread
+                    write_future = self._io_pool.submit(
+                        cv2.imwrite, img_path, face_img.copy(),
+                        [cv2.IMWRITE_JPEG_QUALITY, 85]
+                    )
+                
+                recognized_persons.append({
+                    'name': name,
+                    'person_id': person_id,
+                    'confidence': confidence,
+                    'encoding': face_encoding,
+                    'image_path': img_path,
+                    'write_future': write_future,
+                    'location': (top, right, bottom, left),
+                    'timestamp': datetime.now()
+                })
         
         return recognized_persons
     
@@ -148,6 +298,20 @@ class FaceRecognitionSystem:
         
         return False
     
+    def _reader_loop(self):
+        """Continuously drain frames from the DVR into the latest-frame slot"""
+        while self.running:
+            frame = self.dvr.get_frame()
+
+            if frame is None:
+                print("⚠ Failed to get frame from DVR, retrying...")
+                time.sleep(1)
+                continue
+
+            with self._frame_lock:
+                self._latest_frame = frame
+                self._frame_seq += 1
+
     def run(self):
         """Main recognition loop"""
         self.running = True
@@ -158,60 +322,96 @@ class FaceRecognitionSystem:
         print(f"👥 Known Persons: {len(self.known_faces['names'])}")
         print(f"🔔 Notifications: {'Enabled' if self.config.get('notifications', {}).get('enabled') else 'Disabled'}")
         print("="*50 + "\n")
-        
-        frame_count = 0
+
+        # Reader thread owns all DVR I/O; this loop only recognizes
+        self._reader_thread = threading.Thread(target=self._reader_loop, daemon=True)
+        self._reader_thread.start()
+
+        last_seq = 0
         process_every_n_frames = self.config.get('recognition', {}).get('process_every_n_frames', 6)
-        
+        frame_batch = []  # sampled frames awaiting a (CNN) detector pass
+        batch_started = 0.0  # when the oldest batched frame was sampled
+
         while self.running:
             try:
-                # Get frame from DVR
-                frame = self.dvr.get_frame()
-                
-                if frame is None:
-                    print("⚠ Failed to get frame from DVR, retrying...")
-                    time.sleep(1)
+                # Grab the newest frame; skip until N new frames arrived
+                with self._frame_lock:
+                    frame = self._latest_frame
+                    seq = self._frame_seq
+
+                if frame is None or seq - last_seq < process_every_n_frames:
+                    time.sleep(0.01)
                     continue
-                
-                frame_count += 1
-                
-                # Process every Nth frame to reduce CPU usage
-                if frame_count % process_every_n_frames == 0:
-                    persons = self.process_frame(frame)
-                    
-                    for person in persons:
-                        if person['person_id']:
-                            # Known person detected
-                            if self.should_notify(person['person_id']):
-                                self.db.log_visit(
-                                    person['person_id'],
-                                    person['confidence'],
-                                    person['image_path']
-                                )
-                                
-                                self.notifier.send_notification(
-                                    title=f"✓ {person['name']} Detected",
-                                    message=f"{person['name']} arrived at entrance",
-                                    image_path=person['image_path'],
-                                    confidence=person['confidence']
-                                )
-                                
-                                print(f"✓ [{datetime.now().strftime('%H:%M:%S')}] Recognized: {person['name']} (confidence: {person['confidence']:.2%})")
-                        else:
-                            # Unknown person detected
-                            if self.should_notify(None, cooldown_seconds=60):
-                                self.db.log_unknown_visitor(person['image_path'])
-                                
-                                self.notifier.send_notification(
-                                    title="⚠ Unknown Person Detected",
-                                    message="Unknown visitor at entrance - please identify",
-                                    image_path=person['image_path']
-                                )
-                                
-                                print(f"⚠ [{datetime.now().strftime('%H:%M:%S')}] Unknown person detected")
-                
-                # Small delay to prevent CPU overload
-                time.sleep(0.05)
-                
+
+                last_seq = seq
+
+                # Skip static scenes; every Kth sampled frame still runs
+                # the full pipeline as a safety net
+                self._sampled_count += 1
+                scene_active = (self._scene_changed(frame)
+                                or self._sampled_count % self.motion_safety_interval == 0)
+
+                if scene_active:
+                    if not frame_batch:
+                        batch_started = time.monotonic()
+                    frame_batch.append(frame)
+
+                if not frame_batch:
+                    continue
+
+                # With the HOG detector the batch size is 1, so this
+                # processes every sampled frame immediately. A partial
+                # CNN batch is flushed when the scene goes quiet or the
+                # oldest frame ages out, so a detection is never held
+                # back waiting for more motion
+                if (len(frame_batch) < self.detection_batch_size
+                        and scene_active
+                        and time.monotonic() - batch_started < self.batch_max_age):
+                    continue
+
+                persons = self.process_frames(frame_batch)
+                frame_batch = []
+
+                for person in persons:
+                    if person['person_id']:
+                        # Known person detected
+                        if self.should_notify(person['person_id']):
+                            # The crop must be on disk before its path
+                            # reaches the notifier or the dashboard
+                            if person['write_future'] is not None:
+                                person['write_future'].result()
+
+                            self.db.log_visit(
+                                person['person_id'],
+                                person['confidence'],
+                                person['image_path']
+                            )
+                            
+                            self.notifier.send_notification(
+                                title=f"✓ {person['name']} Detected",
+                                message=f"{person['name']} arrived at entrance",
+                                image_path=person['image_path'],
+                                confidence=person['confidence']
+                            )
+                            
+                            print(f"✓ [{datetime.now().strftime('%H:%M:%S')}] Recognized: {person['name']} (confidence: {person['confidence']:.2%})")
+                    else:
+                        # Unknown person detected
+                        if self.should_notify(None, cooldown_seconds=60):
+                            if person['write_future'] is not None:
+                                person['write_future'].result()
+
+                            self.db.log_unknown_visitor(person['image_path'],
+                                                        person['encoding'])
+                            
+                            self.notifier.send_notification(
+                                title="⚠ Unknown Person Detected",
+                                message="Unknown visitor at entrance - please identify",
+                                image_path=person['image_path']
+                            )
+                            
+                            print(f"⚠ [{datetime.now().strftime('%H:%M:%S')}] Unknown person detected")
+
             except KeyboardInterrupt:
                 print("\n⚠ Received shutdown signal...")
                 break
@@ -223,7 +423,11 @@ class FaceRecognitionSystem:
         """Stop the system gracefully"""
         print("\n🛑 Stopping Face Recognition System...")
         self.running = False
+        if self._reader_thread is not None:
+            self._reader_thread.join(timeout=2)
         self.dvr.release()
+        self._io_pool.shutdown(wait=True)  # finish pending image writes
+        self.db.close()  # flush buffered visits before exit
         print("✓ System stopped successfully")
 
 def main():
@@ -5,14 +5,66 @@ Handles multi-channel notifications (Console, Email, Telegram, Web)
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    from requests_toolbelt import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+import collections
+import io
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import json
 import os
+import queue
+import threading
+import time
+
+# Email bodies are 95% static, so the markup is built once at import
+# time (single-line: no indentation bytes) and only the dynamic fields
+# are formatted per send
+_EMAIL_HTML_TMPL = (
+    '<html><body style="font-family:Arial,sans-serif;padding:20px;">'
+    '<h2 style="color:#667eea;">{title}</h2>'
+    '<p style="font-size:16px;">{message}</p>'
+    '<p style="color:#666;font-size:14px;">Time: {ts}</p>'
+    '<hr style="border:1px solid #eee;">'
+    '<p style="color:#999;font-size:12px;">DVR Face Recognition System</p>'
+    '</body></html>'
+)
+
+_EMAIL_DIGEST_TMPL = (
+    '<html><body style="font-family:Arial,sans-serif;padding:20px;">'
+    '<h2 style="color:#667eea;">{count} detections</h2>'
+    '<ul style="font-size:16px;">{items}</ul>'
+    '<p style="color:#666;font-size:14px;">Time: {ts}</p>'
+    '<hr style="border:1px solid #eee;">'
+    '<p style="color:#999;font-size:12px;">DVR Face Recognition System</p>'
+    '</body></html>'
+)
 
 class Notifier:
-    def __init__(self, config):
-        """Initialize notification system"""
+    def __init__(self, config, db=None):
+        """Initialize notification system
+
+        db is only needed when face crops are stored as BLOBs: it
+        resolves db://<id> image paths for photo notifications.
+        """
         self.config = config
+        self.db = db
         self.enabled = config.get('enabled', True)
         
         # Email configuration (SendGrid)
@@ -20,15 +72,81 @@ class Notifier:
         self.sendgrid_api_key = config.get('email', {}).get('sendgrid_api_key')
         self.from_email = config.get('email', {}).get('from_email')
         self.to_email = config.get('email', {}).get('to_email')
+        self._email_headers = {
+            "Authorization": f"Bearer {self.sendgrid_api_key}",
+            "Content-Type": "application/json"
+        }
         
         # Telegram configuration
         self.telegram_enabled = config.get('telegram', {}).get('enabled', False)
         self.telegram_bot_token = config.get('telegram', {}).get('bot_token')
         self.telegram_chat_id = config.get('telegram', {}).get('chat_id')
-        
-        # Web notifications (stored for dashboard)
-        self.web_notifications = []
+
+        # Endpoint URLs and the static payload fields never change, so
+        # they're built once here instead of per send
+        self._sg_url = "https://api.sendgrid.com/v3/mail/send"
+        self._tg_photo_url = f"https://api.telegram.org/bot{self.telegram_bot_token}/sendPhoto"
+        self._tg_text_url = f"https://api.telegram.org/bot{self.telegram_bot_token}/sendMessage"
+        self._tg_base_data = {
+            'chat_id': self.telegram_chat_id,
+            'parse_mode': 'Markdown'
+        }
+
+        # Checked on every send, so resolved once here
+        self._any_remote = self.email_enabled or self.telegram_enabled
+
+        # Web notifications (stored for dashboard), persisted as
+        # append-only JSONL: one compact line per event instead of
+        # rewriting the whole file every time. The bounded deque keeps
+        # newest-first order with O(1) inserts and self-truncation.
         self.max_web_notifications = 100
+        self.web_notifications = collections.deque(maxlen=self.max_web_notifications)
+        self._log_path = 'data/notifications.jsonl'
+        os.makedirs(os.path.dirname(self._log_path), exist_ok=True)
+        self._load_web_notifications()
+        self._log_fh = open(self._log_path, 'a', buffering=1 << 16)
+
+        # Log writes are debounced: lines collect in the 64 KiB buffer
+        # and hit disk at most twice a second (or when the queue idles)
+        self._log_dirty = False
+        self._log_flush_interval = 0.5
+        self._last_log_flush = time.monotonic()
+
+        # Pooled keep-alive session: repeated SendGrid/Telegram calls
+        # reuse one TLS connection instead of re-handshaking per call.
+        # With httpx installed the client speaks HTTP/2, multiplexing
+        # every send to a host over a single connection; the worker
+        # thread already provides the concurrency, so the synchronous
+        # client is all that's needed.
+        if httpx is not None:
+            self._timeout = httpx.Timeout(10.0, connect=3.0)
+            self._session = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=8, max_connections=32),
+                timeout=self._timeout
+            )
+        else:
+            self._session = requests.Session()
+            self._session.mount('https://', HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=16,
+                max_retries=Retry(
+                    total=3,
+                    backoff_factor=0.2,
+                    status_forcelist=[429, 500, 502, 503, 504]
+                )
+            ))
+            self._timeout = (3.05, 10)  # (connect, read) seconds
+
+        # Remote sends are queued to a background worker so callers in
+        # the recognition loop never wait on HTTPS round trips; email
+        # and Telegram for one event go out in parallel via the pool
+        self._queue = queue.Queue(maxsize=1000)
+        self._batch_window = 2.0   # seconds to wait for more events
+        self._max_batch_size = 20  # events coalesced into one send
+        self._send_pool = ThreadPoolExecutor(max_workers=4)
+        self._worker = threading.Thread(target=self._worker_loop, daemon=True)
+        self._worker.start()
         
         if self.enabled:
             print("✓ Notification system initialized")
@@ -56,19 +174,91 @@ class Notifier:
         # Web notification (store for dashboard)
         self._store_web_notification(title, full_message, image_path, timestamp)
         
-        # Email notification
-        if self.email_enabled:
-            self._send_email_notification(title, full_message, image_path)
-        
-        # Telegram notification
-        if self.telegram_enabled:
-            self._send_telegram_notification(title, full_message, image_path)
-    
+        # Email / Telegram notifications (sent by the worker thread)
+        if self._any_remote:
+            self._enqueue(title, full_message, image_path)
+
+    def _enqueue(self, title, message, image_path):
+        """Queue a notification for the background worker (never blocks)"""
+        try:
+            self._queue.put_nowait((title, message, image_path))
+        except queue.Full:
+            # Drop the oldest event rather than stalling the caller
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait((title, message, image_path))
+            except queue.Full:
+                pass
+
+    def _worker_loop(self):
+        """Drain queued notifications, coalescing bursts into one send"""
+        while True:
+            try:
+                events = [self._queue.get(timeout=self._batch_window)]
+            except queue.Empty:
+                # Idle: make sure the last buffered log lines land
+                if self._log_dirty:
+                    self._flush_log()
+                continue
+
+            # A burst (e.g. a group walking in) becomes one API call
+            # per channel instead of one per event
+            while len(events) < self._max_batch_size:
+                try:
+                    events.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            futures = []
+            if self.email_enabled:
+                if len(events) == 1:
+                    futures.append(self._send_pool.submit(
+                        self._send_email_notification, *events[0]))
+                else:
+                    futures.append(self._send_pool.submit(
+                        self._send_email_digest, events))
+            if self.telegram_enabled:
+                if len(events) == 1:
+                    futures.append(self._send_pool.submit(
+                        self._send_telegram_notification, *events[0]))
+                else:
+                    futures.append(self._send_pool.submit(
+                        self._send_telegram_digest, events))
+
+            # The send methods report their own errors; waiting just
+            # keeps the queue from racing ahead of the sockets
+            for future in futures:
+                future.result()
+
+            for _ in events:
+                self._queue.task_done()
+
     def _send_console_notification(self, title, message, timestamp):
         """Print notification to console"""
         print(f"📢 [{timestamp}] {title}")
         print(f"   {message}")
     
+    def _load_web_notifications(self):
+        """Rebuild the in-memory notification list from the JSONL log"""
+        try:
+            with open(self._log_path, 'r') as f:
+                tail = collections.deque(f, maxlen=self.max_web_notifications)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"⚠ Failed to load web notifications: {e}")
+            return
+
+        # Lines are chronological; the in-memory deque is newest-first
+        for line in tail:
+            try:
+                self.web_notifications.appendleft((orjson or json).loads(line))
+            except ValueError:
+                continue
+
     def _store_web_notification(self, title, message, image_path, timestamp):
         """Store notification for web dashboard"""
         notification = {
@@ -77,20 +267,29 @@ class Notifier:
             'image_path': image_path,
             'timestamp': timestamp
         }
-        
-        self.web_notifications.insert(0, notification)
-        
-        # Keep only last N notifications
-        if len(self.web_notifications) > self.max_web_notifications:
-            self.web_notifications = self.web_notifications[:self.max_web_notifications]
-        
-        # Save to file for persistence
+
+        # maxlen evicts the oldest entry automatically
+        self.web_notifications.appendleft(notification)
+
+        # Append one compact line to the buffered log
         try:
-            os.makedirs('data', exist_ok=True)
-            with open('data/notifications.json', 'w') as f:
-                json.dump(self.web_notifications, f, indent=2)
+            line = (orjson.dumps(notification).decode() if orjson
+                    else json.dumps(notification, separators=(',', ':')))
+            self._log_fh.write(line + '\n')
+            self._log_dirty = True
+            if time.monotonic() - self._last_log_flush >= self._log_flush_interval:
+                self._flush_log()
         except Exception as e:
             print(f"⚠ Failed to save web notifications: {e}")
+
+    def _flush_log(self):
+        """Push buffered notification lines to disk"""
+        try:
+            self._log_fh.flush()
+            self._log_dirty = False
+            self._last_log_flush = time.monotonic()
+        except Exception as e:
+            print(f"⚠ Failed to flush web notifications: {e}")
     
     def _send_email_notification(self, title, message, image_path=None):
         """Send email notification via SendGrid"""
@@ -98,30 +297,12 @@ class Notifier:
             return
         
         try:
-            url = "https://api.sendgrid.com/v3/mail/send"
-            
-            headers = {
-                "Authorization": f"Bearer {self.sendgrid_api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            # Build email content
-            html_content = f"""
-            <html>
-            <body style="font-family: Arial, sans-serif; padding: 20px;">
-                <h2 style="color: #667eea;">{title}</h2>
-                <p style="font-size: 16px;">{message}</p>
-                <p style="color: #666; font-size: 14px;">
-                    Time: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-                </p>
-                <hr style="border: 1px solid #eee;">
-                <p style="color: #999; font-size: 12px;">
-                    DVR Face Recognition System
-                </p>
-            </body>
-            </html>
-            """
-            
+            html_content = _EMAIL_HTML_TMPL.format_map({
+                'title': title,
+                'message': message,
+                'ts': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            })
+
             data = {
                 "personalizations": [{
                     "to": [{"email": self.to_email}],
@@ -133,9 +314,9 @@ class Notifier:
                     "value": html_content
                 }]
             }
-            
-            response = requests.post(url, headers=headers, json=data)
-            
+
+            response = self._session.post(self._sg_url, headers=self._email_headers, json=data, timeout=self._timeout)
+
             if response.status_code == 202:
                 print(f"  ✓ Email sent successfully")
             else:
@@ -144,6 +325,69 @@ class Notifier:
         except Exception as e:
             print(f"  ❌ Email error: {e}")
     
+    def _send_email_digest(self, events):
+        """Send one email summarizing a burst of notifications"""
+        if not self.sendgrid_api_key or not self.from_email or not self.to_email:
+            return
+
+        items = "".join(
+            f"<li><b>{title}</b> — {message}</li>"
+            for title, message, _ in events
+        )
+
+        html_content = _EMAIL_DIGEST_TMPL.format_map({
+            'count': len(events),
+            'items': items,
+            'ts': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+
+        try:
+            data = {
+                "personalizations": [{
+                    "to": [{"email": self.to_email}],
+                    "subject": f"🎥 {len(events)} detections"
+                }],
+                "from": {"email": self.from_email},
+                "content": [{
+                    "type": "text/html",
+                    "value": html_content
+                }]
+            }
+
+            response = self._session.post(self._sg_url, headers=self._email_headers, json=data, timeout=self._timeout)
+
+            if response.status_code == 202:
+                print(f"  ✓ Email digest sent ({len(events)} events)")
+            else:
+                print(f"  ⚠ Email digest failed: {response.status_code}")
+
+        except Exception as e:
+            print(f"  ❌ Email digest error: {e}")
+
+    def _send_telegram_digest(self, events):
+        """Send one Telegram message summarizing a burst of notifications"""
+        if not self.telegram_bot_token or not self.telegram_chat_id:
+            return
+
+        try:
+            lines = "\n".join(f"• *{title}*: {message}" for title, message, _ in events)
+            telegram_message = (
+                f"🎥 *{len(events)} detections*\n\n{lines}\n\n"
+                f"_Time: {datetime.now().strftime('%H:%M:%S')}_"
+            )
+
+            data = {**self._tg_base_data, 'text': telegram_message}
+
+            response = self._session.post(self._tg_text_url, data=data, timeout=self._timeout)
+
+            if response.status_code == 200:
+                print(f"  ✓ Telegram digest sent ({len(events)} events)")
+            else:
+                print(f"  ⚠ Telegram digest failed: {response.status_code}")
+
+        except Exception as e:
+            print(f"  ❌ Telegram digest error: {e}")
+
     def _send_telegram_notification(self, title, message, image_path=None):
         """Send Telegram notification"""
         if not self.telegram_bot_token or not self.telegram_chat_id:
@@ -153,30 +397,54 @@ class Notifier:
             # Format message
             telegram_message = f"🎥 *{title}*\n\n{message}\n\n_Time: {datetime.now().strftime('%H:%M:%S')}_"
             
-            if image_path and os.path.exists(image_path):
+            # EAFP: one open() instead of a stat + open, and a missing
+            # or unreadable image degrades to the text-only message
+            photo = None
+            photo_name = None
+            if image_path and image_path.startswith('db://'):
+                # Crops stored as BLOBs resolve through the database
+                try:
+                    jpeg = self.db.get_face_image(int(image_path[5:])) if self.db else None
+                except ValueError:
+                    jpeg = None
+                if jpeg is not None:
+                    photo = io.BytesIO(jpeg)
+                    photo_name = f"{image_path[5:]}.jpg"
+            elif image_path:
+                try:
+                    photo = open(image_path, 'rb')
+                    photo_name = os.path.basename(image_path)
+                except OSError:
+                    photo = None
+
+            if photo is not None:
                 # Send photo with caption
-                url = f"https://api.telegram.org/bot{self.telegram_bot_token}/sendPhoto"
-                
-                with open(image_path, 'rb') as photo:
-                    files = {'photo': photo}
-                    data = {
-                        'chat_id': self.telegram_chat_id,
-                        'caption': telegram_message,
-                        'parse_mode': 'Markdown'
-                    }
-                    
-                    response = requests.post(url, files=files, data=data)
+                data = {**self._tg_base_data, 'caption': telegram_message}
+
+                with photo:
+                    if httpx is None and MultipartEncoder is not None:
+                        # Stream the multipart body so a large JPEG is
+                        # never buffered whole just for Content-Length
+                        encoder = MultipartEncoder(fields={
+                            **{key: str(value) for key, value in data.items()},
+                            'photo': (photo_name, photo, 'image/jpeg')
+                        })
+                        response = self._session.post(
+                            self._tg_photo_url, data=encoder,
+                            headers={'Content-Type': encoder.content_type},
+                            timeout=self._timeout
+                        )
+                    else:
+                        # httpx streams file objects in multipart natively
+                        response = self._session.post(
+                            self._tg_photo_url, files={'photo': photo}, data=data,
+                            timeout=self._timeout
+                        )
             else:
                 # Send text message only
-                url = f"https://api.telegram.org/bot{self.telegram_bot_token}/sendMessage"
-                
-                data = {
-                    'chat_id': self.telegram_chat_id,
-                    'text': telegram_message,
-                    'parse_mode': 'Markdown'
-                }
-                
-                response = requests.post(url, data=data)
+                data = {**self._tg_base_data, 'text': telegram_message}
+
+                response = self._session.post(self._tg_text_url, data=data, timeout=self._timeout)
             
             if response.status_code == 200:
                 print(f"  ✓ Telegram notification sent")
@@ -188,13 +456,14 @@ class Notifier:
     
     def get_recent_notifications(self, limit=20):
         """Get recent web notifications"""
-        return self.web_notifications[:limit]
-    
+        return list(itertools.islice(self.web_notifications, limit))
+
     def clear_notifications(self):
         """Clear all web notifications"""
-        self.web_notifications = []
+        self.web_notifications.clear()
         try:
-            if os.path.exists('data/notifications.json'):
-                os.remove('data/notifications.json')
+            # Truncate the log and keep appending to the same handle
+            self._log_fh.close()
+            self._log_fh = open(self._log_path, 'w', buffering=1 << 16)
         except Exception as e:
             print(f"⚠ Failed to clear notifications: {e}")
@@ -4,9 +4,10 @@ Web Interface for DVR Face Recognition System
 Flask-based dashboard for monitoring and management
 """
 
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, abort
 import sys
 import os
+import shutil
 
 # Add system directory to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'system'))
@@ -16,14 +17,76 @@ import cv2
 import numpy as np
 from database import Database
 import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+import time
+import functools
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.json.sort_keys = False  # skip re-sorting keys on every jsonify
+
+if orjson is not None:
+    from flask.json.provider import JSONProvider
+
+    class OrjsonProvider(JSONProvider):
+        """Serve every jsonify()/get_json() through orjson"""
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = OrjsonProvider(app)
 
 # Initialize database
 db = Database('../data/faces.db')
 
+# Created once at import; per-request makedirs cost ~3 syscalls each
+IMAGES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'images'))
+os.makedirs(IMAGES_DIR, exist_ok=True)
+
+def _encode_image(filepath):
+    """Load an image and compute face encodings (runs in a worker process)"""
+    image = face_recognition.load_image_file(filepath)
+
+    # Phone photos can be 4000px+; dlib resamples faces to 150x150
+    # internally, so capping the long side at 1024 loses nothing
+    scale = min(1.0, 1024 / max(image.shape[:2]))
+    if scale < 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale,
+                           interpolation=cv2.INTER_AREA)
+
+    return face_recognition.face_encodings(image, num_jitters=1, model='small')
+
+# dlib holds the GIL, so encode uploads in separate processes to keep
+# the request workers free for dashboard polling
+_encoder_pool = ProcessPoolExecutor(max_workers=2)
+
+def _get_json():
+    """Parse a JSON body directly; cache=False skips Werkzeug's body copy
+
+    Multipart/form posts (the persons page upload) fall through to
+    normal form parsing, and malformed JSON is a clean 400.
+    """
+    if request.is_json:
+        try:
+            return (orjson or json).loads(request.get_data(cache=False))
+        except ValueError:
+            abort(400, description='Invalid JSON body')
+    return request.form
+
+def _save_upload(file, filepath):
+    """Write an uploaded file in 1 MiB chunks (file.save copies 16 KiB at a time)"""
+    with open(filepath, 'wb', buffering=1 << 20) as out:
+        shutil.copyfileobj(file.stream, out, length=1 << 20)
+
 @app.route('/')
 def index():
     """Main dashboard page"""
@@ -38,10 +101,7 @@ def dashboard():
 @app.route('/persons')
 def persons():
     """Person management page"""
-    all_persons = db.get_all_persons()
-    # Remove face encoding from response (too large for template)
-    for person in all_persons:
-        person.pop('face_encoding', None)
+    all_persons = db.get_all_persons_summary()
     return render_template('persons.html', persons=all_persons)
 
 @app.route('/settings')
@@ -51,19 +111,21 @@ def settings():
 
 # API Endpoints
 
+@functools.lru_cache(maxsize=1)
+def _stats_cached(bucket):
+    """Statistics keyed on a 2-second time bucket (dashboard polls often)"""
+    return db.get_statistics()
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get system statistics"""
-    stats = db.get_statistics()
+    stats = _stats_cached(int(time.time()) // 2)
     return jsonify(stats)
 
 @app.route('/api/persons', methods=['GET'])
 def get_persons():
     """Get all persons"""
-    persons = db.get_all_persons()
-    # Convert blob to list for JSON serialization
-    for person in persons:
-        person.pop('face_encoding', None)
+    persons = db.get_all_persons_summary()
     return jsonify(persons)
 
 @app.route('/api/person/<int:person_id>', methods=['GET'])
@@ -82,7 +144,7 @@ def get_person(person_id):
 def add_person():
     """Add new person"""
     try:
-        data = request.get_json()
+        data = _get_json()
         name = data.get('name')
         image_data = data.get('image_data')  # Base64 or file path
         notes = data.get('notes', '')
@@ -98,13 +160,12 @@ def add_person():
             
             # Save uploaded file
             filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{name.replace(' ', '_')}.jpg"
-            filepath = os.path.join('../data/images', filename)
-            os.makedirs('../data/images', exist_ok=True)
-            file.save(filepath)
+            filepath = os.path.join(IMAGES_DIR, filename)
+            _save_upload(file, filepath)
             
-            # Load image and generate encoding
-            image = face_recognition.load_image_file(filepath)
-            encodings = face_recognition.face_encodings(image)
+            # Generate encoding off the request thread (one jitter pass
+            # and the small landmark model are plenty for enrollment photos)
+            encodings = _encoder_pool.submit(_encode_image, filepath).result(timeout=30)
             
             if len(encodings) == 0:
                 os.remove(filepath)
@@ -130,7 +191,7 @@ def add_person():
 @app.route('/api/person/<int:person_id>', methods=['PUT'])
 def update_person(person_id):
     """Update person information"""
-    data = request.get_json()
+    data = _get_json()
     name = data.get('name')
     notes = data.get('notes')
     
@@ -168,7 +229,7 @@ def get_unknown():
 @app.route('/api/unknown/<int:unknown_id>/identify', methods=['POST'])
 def identify_unknown(unknown_id):
     """Identify an unknown visitor"""
-    data = request.get_json()
+    data = _get_json()
     name = data.get('name')
     notes = data.get('notes', '')
     
@@ -176,23 +237,27 @@ def identify_unknown(unknown_id):
         return jsonify({'error': 'Name is required'}), 400
     
     # Get unknown visitor
-    unknown_visitors = db.get_unknown_visitors(limit=1000)
-    unknown = next((v for v in unknown_visitors if v['id'] == unknown_id), None)
+    unknown = db.get_unknown_visitor(unknown_id)
     
     if not unknown:
         return jsonify({'error': 'Unknown visitor not found'}), 404
     
-    image_path = unknown['image_path']
-    
     # Add as new person
     try:
-        image = face_recognition.load_image_file(image_path)
-        encodings = face_recognition.face_encodings(image)
-        
-        if len(encodings) == 0:
-            return jsonify({'error': 'No face found in image'}), 400
-        
-        encoding = encodings[0]
+        # The encoding was computed when the visitor was detected, so
+        # reuse it instead of re-running the dlib pipeline; fall back
+        # to the image only for rows logged before it was stored
+        if unknown.get('face_encoding'):
+            encoding = Database.unpack_encoding(unknown['face_encoding'])
+        else:
+            encodings = _encoder_pool.submit(
+                _encode_image, unknown['image_path']).result(timeout=30)
+
+            if len(encodings) == 0:
+                return jsonify({'error': 'No face found in image'}), 400
+
+            encoding = encodings[0]
+
         person_id = db.add_person(name, encoding, notes)
         
         if person_id:
@@ -210,22 +275,28 @@ def identify_unknown(unknown_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@functools.lru_cache(maxsize=1)
+def _config_cached(mtime_ns):
+    """Sanitized config, re-read only when the file changes on disk"""
+    with open('../config/config.json', 'rb') as f:
+        config = (orjson or json).loads(f.read())
+
+    # Remove sensitive data
+    if 'dvr' in config:
+        config['dvr'].pop('password', None)
+    if 'notifications' in config:
+        if 'email' in config['notifications']:
+            config['notifications']['email'].pop('sendgrid_api_key', None)
+        if 'telegram' in config['notifications']:
+            config['notifications']['telegram'].pop('bot_token', None)
+
+    return config
+
 @app.route('/api/config', methods=['GET'])
 def get_config():
     """Get configuration (sensitive data removed)"""
     try:
-        with open('../config/config.json', 'r') as f:
-            config = json.load(f)
-        
-        # Remove sensitive data
-        if 'dvr' in config:
-            config['dvr'].pop('password', None)
-        if 'notifications' in config:
-            if 'email' in config['notifications']:
-                config['notifications']['email'].pop('sendgrid_api_key', None)
-            if 'telegram' in config['notifications']:
-                config['notifications']['telegram'].pop('bot_token', None)
-        
+        config = _config_cached(os.stat('../config/config.json').st_mtime_ns)
         return jsonify(config)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -234,10 +305,13 @@ def get_config():
 def update_config():
     """Update configuration"""
     try:
-        data = request.get_json()
-        
-        with open('../config/config.json', 'w') as f:
-            json.dump(data, f, indent=2)
+        data = _get_json()
+
+        with open('../config/config.json', 'wb') as f:
+            if orjson is not None:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+            else:
+                f.write(json.dumps(data, indent=2).encode())
         
         return jsonify({'success': True, 'message': 'Configuration updated'})
     except Exception as e:
@@ -246,7 +320,20 @@ def update_config():
 @app.route('/images/<path:filename>')
 def serve_image(filename):
     """Serve images"""
-    return send_from_directory('../data/images', filename)
+    # Filenames are timestamped and never rewritten, so let browsers
+    # cache aggressively and answer repeat loads with 304s
+    resp = send_from_directory(IMAGES_DIR, filename,
+                               conditional=True, max_age=2592000)
+    resp.headers['Cache-Control'] = 'public, max-age=2592000, immutable'
+    return resp
+
+@app.route('/images/db/<int:image_id>')
+def serve_db_image(image_id):
+    """Serve face crops stored as BLOBs (db://<id> image paths)"""
+    jpeg = db.get_face_image(image_id)
+    if jpeg is None:
+        return jsonify({'error': 'Image not found'}), 404
+    return Response(jpeg, mimetype='image/jpeg')
 
 @app.route('/api/upload', methods=['POST'])
 def upload_image():
@@ -261,9 +348,8 @@ def upload_image():
     
     # Save file
     filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
-    filepath = os.path.join('../data/images', filename)
-    os.makedirs('../data/images', exist_ok=True)
-    file.save(filepath)
+    filepath = os.path.join(IMAGES_DIR, filename)
+    _save_upload(file, filepath)
     
     return jsonify({
         'success': True,
@@ -281,5 +367,17 @@ if __name__ == '__main__':
     print("📱 Access dashboard at: http://localhost:5000")
     print("🌍 Or from network: http://YOUR_IP:5000")
     print("\n")
-    
-    app.run(host='0.0.0.0', port=5000, debug=True)
+
+    if os.environ.get('DEV'):
+        # Werkzeug dev server: single-threaded, blocks all requests
+        # while one handler runs — development only
+        app.run(host='0.0.0.0', port=5000, debug=True)
+    else:
+        try:
+            os.execvp('gunicorn', [
+                'gunicorn', '-w', '4', '-k', 'gthread', '--threads', '4',
+                '--timeout', '60', '-b', '0.0.0.0:5000', 'app:app'
+            ])
+        except FileNotFoundError:
+            print("⚠️  gunicorn not installed, falling back to dev server")
+            app.run(host='0.0.0.0', port=5000, threaded=True)